@@ -1,28 +1,209 @@
 import pandas as pd
+import numpy as np
+import re
+import hashlib
+from functools import lru_cache
+from numba import njit, prange
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
 from langchain.chat_models import ChatOpenAI
 from langchain.agents.agent_types import AgentType
 from engine import StorageManager
+from typing import Dict, List, Optional, Tuple
 import os
 
 # Ensure you have OPENAI_API_KEY in your env or .env file
 # If no key is present, we fallback to simple SQL translation logic for the demo
 
+EMAIL_PATTERN = r"[^@\s]+@[^@\s]+\.[^@\s]+"
+
+def _numeric_columns(df: pd.DataFrame) -> List[str]:
+    # Checked per column so Arrow-backed numeric dtypes are picked up too
+    return [
+        col for col in df.columns
+        if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])
+    ]
+
+def _remove_outliers(df: pd.DataFrame) -> pd.DataFrame:
+    """Drops rows where any numeric column has |z-score| > 3."""
+    numeric = _numeric_columns(df)
+    if not numeric:
+        raise ValueError("remove_outliers needs at least one numeric column")
+    values = df[numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0, ddof=1)
+    # NaN z-scores (missing values, constant columns) compare False and are kept
+    return df[~(np.abs(z) > 3).any(axis=1)]
+
+def _top_performers(df: pd.DataFrame) -> pd.DataFrame:
+    """Keeps the top 10% of rows by the sales column."""
+    sales_cols = [col for col in _numeric_columns(df) if "sales" in str(col).lower()]
+    if not sales_cols:
+        raise ValueError("top_performers needs a numeric 'sales' column")
+    return df.nlargest(max(int(len(df) * 0.1), 1), sales_cols[0])
+
+def _clean_emails(df: pd.DataFrame) -> pd.DataFrame:
+    """Drops rows with a malformed value in any email column."""
+    email_cols = [col for col in df.columns if "email" in str(col).lower()]
+    if not email_cols:
+        raise ValueError("clean_emails needs an 'email' column")
+    valid = np.ones(len(df), dtype=bool)
+    for col in email_cols:
+        valid &= df[col].astype("string").str.fullmatch(EMAIL_PATTERN).fillna(False).to_numpy(dtype=bool)
+    return df[valid]
+
+# Deterministic rules run locally; only rules without an entry here go to the LLM.
+# Each raises ValueError when the frame lacks the columns it works on.
+NATIVE_RULES = {
+    "clean_emails": _clean_emails,
+    "remove_outliers": _remove_outliers,
+    "top_performers": _top_performers,
+}
+
+# --- CUSTOM FILTER FAST PATH ---
+# Handles rules like "Filter rows where Sales > 5000 and Region is 'North'" without the LLM
+PREDICATE_PREFIX = re.compile(r"^\s*(?:filter\s+)?(?:(?:rows|records)\s+)?(?:where|with)\s+", re.I)
+PREDICATE_CLAUSE = re.compile(
+    r"^\s*(?P<col>.+?)\s*(?P<op>>=|<=|!=|==|=|>|<|\bis\s+not\b|\bis\b|\bequals\b)\s*"
+    r"(?P<val>'[^']*'|\"[^\"]*\"|-?\d+(?:\.\d+)?)\s*$",
+    re.I
+)
+OP_ALIASES = {"=": "==", "is": "==", "equals": "==", "is not": "!="}
+OP_CODES = {">": 0, ">=": 1, "<": 2, "<=": 3, "==": 4, "!=": 5}
+
+@njit(parallel=True, cache=True)
+def _fused_mask(columns, ops, values, out):
+    # One pass over the rows, ANDing every clause without intermediate arrays.
+    # Numba specializes (and caches) one kernel per number of clauses.
+    for i in prange(out.shape[0]):
+        keep = 1
+        for j in range(len(columns)):
+            x = columns[j][i]
+            op = ops[j]
+            v = values[j]
+            if op == 0:
+                ok = x > v
+            elif op == 1:
+                ok = x >= v
+            elif op == 2:
+                ok = x < v
+            elif op == 3:
+                ok = x <= v
+            elif op == 4:
+                ok = x == v
+            else:
+                ok = x != v
+            if not ok:
+                keep = 0
+                break
+        out[i] = keep
+
+@lru_cache(maxsize=128)
+def _parse_predicate(rule_description: str, columns: Tuple[str, ...]) -> Optional[List[Tuple[str, str, str, bool]]]:
+    """Parses 'col op value [and ...]' into (column, op, literal, is_quoted) clauses, or None."""
+    body = PREDICATE_PREFIX.sub("", rule_description.strip().rstrip("."))
+    by_name = {col.lower(): col for col in columns}
+    clauses = []
+    for part in re.split(r"\s+and\s+", body, flags=re.I):
+        match = PREDICATE_CLAUSE.match(part)
+        if not match:
+            return None
+        col = by_name.get(match.group("col").strip("`'\"").lower())
+        if col is None:
+            return None
+        op = " ".join(match.group("op").lower().split())
+        literal = match.group("val")
+        quoted = literal[0] in "'\""
+        clauses.append((col, OP_ALIASES.get(op, op), literal[1:-1] if quoted else literal, quoted))
+    return clauses
+
+def _filter_by_predicate(df: pd.DataFrame, rule_description: str) -> Optional[pd.DataFrame]:
+    """Applies a simple ANDed predicate with a compiled kernel. Returns None if the rule doesn't parse."""
+    columns = {str(col): col for col in df.columns}
+    clauses = _parse_predicate(rule_description, tuple(columns))
+    if not clauses:
+        return None
+
+    arrays, ops, values = [], [], []
+    for name, op, literal, quoted in clauses:
+        series = df[columns[name]]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            if quoted:
+                return None
+            # Writable copies throughout: Numba won't type a tuple mixing read-only and writable arrays
+            arrays.append(np.array(series.to_numpy(dtype=np.float64, na_value=np.nan), dtype=np.float64, copy=True))
+            values.append(float(literal))
+        elif pd.api.types.is_string_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            if op not in ("==", "!="):
+                return None
+            # Compare dictionary codes instead of strings; -1 marks nulls, -2 an absent literal
+            codes, uniques = pd.factorize(series)
+            position = pd.Index(uniques).get_indexer([literal])[0]
+            arrays.append(np.array(codes, dtype=np.float64, copy=True))
+            values.append(float(position) if position >= 0 else -2.0)
+        else:
+            return None
+        ops.append(OP_CODES[op])
+
+    mask = np.empty(len(df), dtype=np.uint8)
+    _fused_mask(tuple(arrays), np.array(ops, dtype=np.int64), np.array(values, dtype=np.float64), mask)
+    return df.iloc[mask.view(bool)]
+
+SQL_KEYWORDS = re.compile(r"\b(?:select|from|where|join|group\s+by|order\s+by|limit)\b", re.I)
+
+def _query_expression(df: pd.DataFrame, expression: str) -> Optional[pd.DataFrame]:
+    """Filters by a pandas boolean expression. Returns None if it isn't one."""
+    expression = expression.strip().strip("`").strip()
+    if not expression or SQL_KEYWORDS.search(expression):
+        return None
+    # numexpr only handles NumPy dtypes; Arrow-backed frames go straight to the python engine
+    engine = "numexpr" if all(isinstance(dtype, np.dtype) for dtype in df.dtypes) else "python"
+    try:
+        mask = df.eval(expression, engine=engine)
+    except Exception:
+        return None
+    if not isinstance(mask, pd.Series) or not pd.api.types.is_bool_dtype(mask):
+        return None
+    return df[mask.fillna(False).to_numpy(dtype=bool)]
+
+def warm_up():
+    """Compiles the filter kernels up front so the first user rule doesn't pay for it."""
+    sample = pd.DataFrame({"x": [0.0], "y": ["a"]})
+    _filter_by_predicate(sample, "x > 0")
+    _filter_by_predicate(sample, "x > 0 and y is 'a'")
+    _query_expression(sample, "x > 0")
+
 class TransformationAgent:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, storage: StorageManager = None):
         self.api_key = api_key
-        self.storage = StorageManager()
+        self.storage = storage or StorageManager()
+        # One client per agent so its HTTP connection pool is reused between jobs
+        self.llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", openai_api_key=api_key) if api_key else None
+        # Generated SQL keyed by rule + schema, so repeat clicks skip the LLM entirely.
+        # This is the only cache: answers that failed to run are never stored, so they get regenerated.
+        self.sql_cache: Dict[str, str] = {}
 
-    def apply_business_rule(self, df: pd.DataFrame, rule_description: str, rule_name: str) -> pd.DataFrame:
+    def apply_business_rule(self, df: pd.DataFrame, rule_description: str, rule_name: str,
+                            staging_name: str = "temp_staging") -> pd.DataFrame:
         """
         Applies a transformation based on a natural language rule.
+        staging_name is the table name the frame is queried under by generated SQL.
         """
         print(f"Executing Agent Job: {rule_name}...")
         
+        native_rule = NATIVE_RULES.get(rule_name)
+        if native_rule is not None:
+            return native_rule(df)
+        
+        filtered = _filter_by_predicate(df, rule_description)
+        if filtered is None:
+            filtered = _query_expression(df, rule_description)
+        if filtered is not None:
+            return filtered
+        
         if self.api_key:
             # AI MODE: Use LLM to figure out the transformation
             try:
-                llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", openai_api_key=self.api_key)
+                llm = self.llm
                 agent = create_pandas_dataframe_agent(
                     llm, 
                     df, 
@@ -40,11 +221,22 @@ class TransformationAgent:
                 prompt = f"""
                 You are a data engineer. given the dataframe with columns {df.columns},
                 write a DuckDB SQL query to transform the data according to this rule: "{rule_description}".
-                The table name is 'CURRENT_TABLE'. Return ONLY the SQL string.
+                The table name is CURRENT_TABLE. Return ONLY the SQL string.
                 """
-                response = llm.predict(prompt)
-                sql_query = response.strip().replace("```sql", "").replace("```", "")
-                return self.storage.execute_sql(sql_query, "temp_staging") 
+                cache_key = hashlib.blake2b(
+                    (rule_description + "|" + ",".join(map(str, df.columns))).encode()
+                ).hexdigest()
+                sql_query = self.sql_cache.get(cache_key)
+                if sql_query is None:
+                    response = llm.predict(prompt)
+                    sql_query = response.strip().replace("```sql", "").replace("```", "")
+                # The model sometimes answers with a pandas expression instead of SQL
+                result = _query_expression(df, sql_query)
+                if result is None:
+                    result = self.storage.execute_sql(sql_query, staging_name, df=df)
+                # Only answers that actually ran are cached, so a bad one can be retried
+                self.sql_cache[cache_key] = sql_query
+                return result
                 
             except Exception as e:
                 print(f"AI Agent failed, falling back to pass-through: {e}")
@@ -1,16 +1,20 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import io
+import hashlib
+import orjson
 import time
-from engine import DataIngestor, StorageManager, SearchIndexer
-from agent import TransformationAgent
+import uuid
+from engine import DataIngestor, StorageManager, FAISSIndexer, load_embedding_model
+from agent import TransformationAgent, warm_up
 import plotly.express as px
 import os
 from dotenv import load_dotenv
 
 # --- SAFE CONFIGURATION LOADER ---
-# 1. Load .env file (if it exists locally or in container)
-load_dotenv()
-
 def get_api_key():
     """
     Safely retrieves API Key from either:
@@ -32,8 +36,15 @@ def get_api_key():
     except Exception:
         return ""
 
-# Set the environment variable safely for the rest of the app
-os.environ["OPENAI_API_KEY"] = get_api_key()
+@st.cache_resource(show_spinner=False)
+def _boot():
+    """Process-level setup, run once rather than on every rerun."""
+    # 1. Load .env file (if it exists locally or in container)
+    load_dotenv()
+    # 2. Set the environment variable safely for the rest of the app
+    os.environ["OPENAI_API_KEY"] = get_api_key()
+
+_boot()
 
 # --- STREAMLIT SETUP ---
 st.set_page_config(page_title="Agentic Data Foundry", layout="wide", page_icon="⚡")
@@ -47,9 +58,44 @@ if 'logs' not in st.session_state:
     st.session_state['logs'] = []
 if 'dataset_name' not in st.session_state:
     st.session_state['dataset_name'] = "dataset"
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+
+# --- SHARED RESOURCES ---
+# Built once per process and reused across reruns
+@st.cache_resource
+def get_ingestor():
+    return DataIngestor()
+
+@st.cache_resource
+def get_storage():
+    return StorageManager()
+
+@st.cache_resource
+def get_embedding_model():
+    return load_embedding_model()
+
+@st.cache_resource
+def get_agent(api_key):
+    return TransformationAgent(api_key=api_key, storage=get_storage())
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def ingest_file(file_hash, file_type, _file_bytes):
+    # Keyed on the content hash; the bytes themselves are excluded from hashing
+    return get_ingestor().read_file(io.BytesIO(_file_bytes), file_type)
+
+@st.cache_resource
+def warm_transform_engines():
+    warm_up()
+
+warm_transform_engines()
+
+MAX_LOGS = 200
 
 def log(message):
     st.session_state['logs'].append(f"[{time.strftime('%H:%M:%S')}] {message}")
+    # Keep long sessions from growing the log without bound
+    st.session_state['logs'] = st.session_state['logs'][-MAX_LOGS:]
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -70,9 +116,8 @@ with st.sidebar:
             
     st.markdown("---")
     st.write("## 📝 System Logs")
-    # Show last 10 logs
-    for msg in st.session_state['logs'][-10:]:
-        st.text_area("Log", msg, height=2, label_visibility="collapsed", disabled=True)
+    # Show last 10 logs in a single block
+    st.code("\n".join(st.session_state['logs'][-10:]), language=None)
 
 # --- MAIN APP ---
 
@@ -88,8 +133,9 @@ if st.session_state['current_step'] == 0:
         if st.button("🚀 Ingest Data"):
             with st.spinner("Agent analyzing file structure..."):
                 try:
-                    ingestor = DataIngestor()
-                    df = ingestor.read_file(uploaded_file, file_type)
+                    file_bytes = uploaded_file.getvalue()
+                    file_hash = hashlib.blake2b(file_bytes).hexdigest()
+                    df = ingest_file(file_hash, file_type, file_bytes)
                     st.session_state['data_state'] = df
                     st.session_state['dataset_name'] = uploaded_file.name.split('.')[0]
                     log(f"Ingested {len(df)} rows from {uploaded_file.name}")
@@ -114,7 +160,7 @@ elif st.session_state['current_step'] == 1:
         
     if st.button("💾 Commit to Data Lake"):
         with st.spinner("Writing to Parquet store..."):
-            manager = StorageManager()
+            manager = get_storage()
             path = manager.save_to_bronze(df, st.session_state['dataset_name'])
             log(f"Data persisted to {path}")
             st.session_state['current_step'] = 2
@@ -129,12 +175,14 @@ elif st.session_state['current_step'] == 2:
     index_col = st.selectbox("Key Column", df.columns)
     
     if st.button("🔍 Build Vector Index"):
-        with st.spinner("Embedding vectors (ChromaDB)..."):
-            indexer = SearchIndexer()
+        with st.spinner("Embedding vectors (FAISS)..."):
+            indexer = FAISSIndexer(model=get_embedding_model())
             # Ensure data is string for indexing
             try:
-                indexer.index_data(df, "demo_collection", index_col)
+                indexer.index_data(df, index_col)
                 log(f"Vector index built on column: {index_col}")
+                # Keep the built index across reruns instead of rebuilding it
+                st.session_state['indexer'] = indexer
                 st.session_state['index_col'] = index_col
                 st.session_state['current_step'] = 3
                 st.rerun()
@@ -157,8 +205,8 @@ elif st.session_state['current_step'] == 3:
         query = st.text_input("Ask a question or search by concept (e.g., 'high value transactions')")
         if query:
             try:
-                indexer = SearchIndexer()
-                results = indexer.search(query, "demo_collection")
+                indexer = st.session_state['indexer']
+                results = indexer.search(query)
                 
                 st.write("### Research Results")
                 # Display results in a readable way
@@ -179,7 +227,7 @@ elif st.session_state['current_step'] == 4:
     if not has_key:
         st.warning("⚠️ No OpenAI API Key found. The Agent will run in 'Manual Fallback Mode'.")
     
-    agent = TransformationAgent(api_key=os.environ.get("OPENAI_API_KEY"))
+    agent = get_agent(os.environ.get("OPENAI_API_KEY"))
     rules_dict = agent.get_rule_dictionary()
     
     col1, col2 = st.columns([1, 2])
@@ -202,7 +250,10 @@ elif st.session_state['current_step'] == 4:
                 try:
                     # Pass data_state to agent
                     df = st.session_state['data_state']
-                    new_df = agent.apply_business_rule(df, rule_input, selected_rule)
+                    new_df = agent.apply_business_rule(
+                        df, rule_input, selected_rule,
+                        staging_name=f"staging_{st.session_state['session_id']}"
+                    )
                     
                     st.session_state['data_state'] = new_df
                     log(f"Applied rule: {selected_rule}")
@@ -228,27 +279,48 @@ elif st.session_state['current_step'] == 5:
     with tab1:
         st.caption("GET /api/v1/data/latest")
         if st.session_state['data_state'] is not None:
-            st.json(st.session_state['data_state'].head(5).to_dict(orient='records'))
+            preview = pa.Table.from_pandas(st.session_state['data_state'].head(5), preserve_index=False)
+            st.json(orjson.dumps(preview.to_pylist(), default=str).decode())
         
     with tab2:
         df = st.session_state['data_state']
         if df is not None:
-            numeric_cols = df.select_dtypes(include=['float', 'int']).columns
+            # Checked per column: select_dtypes doesn't match Arrow-backed numeric dtypes
+            numeric_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
             if len(numeric_cols) > 0:
                 x_axis = st.selectbox("X Axis", df.columns)
                 y_axis = st.selectbox("Y Axis", numeric_cols)
-                fig = px.bar(df, x=x_axis, y=y_axis, title="Data Visualization")
+                # Aggregate in DuckDB so Plotly only sees the top groups, not every row
+                agg = get_storage().aggregate(df, x_axis, y_axis)
+                fig = px.bar(agg, x=x_axis, y=f"sum({y_axis})", title="Data Visualization")
                 st.plotly_chart(fig, use_container_width=True)
             else:
                 st.warning("No numeric data for visualization.")
             
     with tab3:
         if st.session_state['data_state'] is not None:
-            csv = st.session_state['data_state'].to_csv(index=False).encode('utf-8')
-            st.download_button("Download Processed CSV", csv, "processed_data.csv", "text/csv")
+            export_format = st.radio("Format", ["Parquet", "CSV"], horizontal=True)
+            # Serialize only on request; every rerun of this step would otherwise rebuild the file
+            if st.button("📦 Prepare Export"):
+                # Arrow's writers go straight to bytes (no intermediate str copy)
+                table = pa.Table.from_pandas(st.session_state['data_state'], preserve_index=False)
+                buf = io.BytesIO()
+                if export_format == "Parquet":
+                    pq.write_table(table, buf, compression="zstd")
+                else:
+                    pa_csv.write_csv(table, buf)
+                st.session_state['export'] = (export_format, buf.getvalue())
+            export = st.session_state.get('export')
+            if export is not None and export[0] == export_format:
+                if export_format == "Parquet":
+                    st.download_button("Download Processed Parquet", export[1], "processed_data.parquet", "application/octet-stream")
+                else:
+                    st.download_button("Download Processed CSV", export[1], "processed_data.csv", "text/csv")
     
     if st.button("🔄 Start New Pipeline"):
         st.session_state['current_step'] = 0
         st.session_state['data_state'] = None
+        st.session_state.pop('indexer', None)
+        st.session_state.pop('export', None)
         st.rerun()
 
@@ -1,18 +1,45 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import duckdb
 import os
 import uuid
 import io
 import json
 import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any
 from pypdf import PdfReader
+from pdf_worker import extract_page_range
 import chromadb
-from chromadb.utils import embedding_functions
+import faiss
+import torch
+from sentence_transformers import SentenceTransformer
 
 # Constants
 STORAGE_PATH = "./data_lake"
 DB_PATH = "metadata.db"
+INDEX_BATCH_SIZE = 250
+EMBED_MODEL = "all-MiniLM-L6-v2" # 384-dim vectors
+EMBED_BATCH_SIZE = 256
+SQ_RANGE_MARGIN = 1e-3
+PARQUET_MIN_ROW_GROUP = 100_000
+PDF_PARALLEL_MIN_PAGES = 32 # Pages per worker; fewer and start-up costs more than it saves
+
+def _quote_identifier(name) -> str:
+    """Quotes a name for use as a DuckDB identifier."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _quote_literal(value) -> str:
+    """Quotes a value for use as a DuckDB string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def to_arrow_backed(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts a frame to Arrow-backed columns, the layout used throughout the pipeline."""
+    return df.convert_dtypes(dtype_backend="pyarrow")
 
 class DataIngestor:
     """Handles raw data ingestion from various sources."""
@@ -21,16 +48,32 @@ class DataIngestor:
     def read_file(file_obj, file_type: str) -> pd.DataFrame:
         try:
             if file_type == "csv":
-                return pd.read_csv(file_obj)
+                # DuckDB's parallel reader, handed over as Arrow-backed columns
+                with duckdb.connect() as con:
+                    return con.read_csv(file_obj).fetch_arrow_table().to_pandas(types_mapper=pd.ArrowDtype)
             elif file_type == "excel":
-                return pd.read_excel(file_obj)
+                return to_arrow_backed(pd.read_excel(file_obj))
             elif file_type == "json":
-                return pd.read_json(file_obj)
+                # pandas understands every orient (e.g. the column-keyed shape to_json() writes)
+                return to_arrow_backed(pd.read_json(file_obj))
             elif file_type == "pdf":
-                # Basic PDF text extraction
-                reader = PdfReader(file_obj)
-                text = [page.extract_text() for page in reader.pages]
-                return pd.DataFrame({"content": text, "page": range(1, len(text) + 1)})
+                # Basic PDF text extraction, split across processes for large documents
+                data = file_obj.read()
+                n_pages = len(PdfReader(io.BytesIO(data)).pages)
+                text = [None] * n_pages
+                workers = min(os.cpu_count() or 1, n_pages // PDF_PARALLEL_MIN_PAGES)
+                if workers <= 1:
+                    text[:] = extract_page_range(data, 0, n_pages)
+                else:
+                    chunk = -(-n_pages // workers)
+                    # spawn, not fork: forking the threaded Streamlit server can deadlock
+                    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                        starts = range(0, n_pages, chunk)
+                        futures = [pool.submit(extract_page_range, data, i, min(i + chunk, n_pages)) for i in starts]
+                        for start, future in zip(starts, futures):
+                            pages = future.result()
+                            text[start:start + len(pages)] = pages
+                return to_arrow_backed(pd.DataFrame({"content": text, "page": np.arange(1, n_pages + 1, dtype=np.int32)}))
             else:
                 raise ValueError(f"Unsupported format: {file_type}")
         except Exception as e:
@@ -42,32 +85,120 @@ class StorageManager:
     def __init__(self):
         os.makedirs(STORAGE_PATH, exist_ok=True)
         self.con = duckdb.connect(database=':memory:') # In-memory DuckDB for speed
+        # Keep decoded Parquet metadata around between queries on the same file
+        self.con.execute("PRAGMA enable_object_cache")
 
     def save_to_bronze(self, df: pd.DataFrame, dataset_name: str) -> str:
-        """Saves raw data to Parquet."""
+        """Saves raw data to Parquet (zstd, dictionary-encoded)."""
         file_path = f"{STORAGE_PATH}/{dataset_name}.parquet"
-        df.to_parquet(file_path, index=False)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # Clustering on the usual filter column makes row-group min/max stats selective
+        sort_col = self._pushdown_column(table.schema)
+        if sort_col is not None:
+            table = table.sort_by([(sort_col, "descending")])
+        pq.write_table(
+            table,
+            file_path,
+            compression="zstd",
+            compression_level=3,
+            # Row groups of >= 100k rows, about 8 per file for large frames. Below ~8M rows this
+            # means more, smaller groups than pyarrow's 1Mi default, for finer zone-map pruning.
+            row_group_size=max(len(df) // 8, PARQUET_MIN_ROW_GROUP),
+            use_dictionary=True
+        )
+        self.register_dataset(dataset_name, file_path)
         return file_path
 
+    @staticmethod
+    def _pushdown_column(schema: pa.Schema):
+        for field in schema:
+            if "sales" in field.name.lower() and (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)):
+                return field.name
+        return None
+
+    def register_dataset(self, dataset_name: str, file_path: str):
+        """Exposes a Parquet file as a DuckDB view so queries can refer to it by name."""
+        # A plain read_parquet scan lets DuckDB push filters down to row-group zone maps
+        with self.con.cursor() as cur:
+            # Both come from the upload's file name, so they are escaped
+            cur.execute(
+                f"CREATE OR REPLACE VIEW {_quote_identifier(dataset_name)} AS "
+                f"SELECT * FROM read_parquet({_quote_literal(file_path)}, hive_partitioning=false)"
+            )
+
     def load_dataset(self, dataset_name: str) -> pd.DataFrame:
         file_path = f"{STORAGE_PATH}/{dataset_name}.parquet"
         if os.path.exists(file_path):
-            return pd.read_parquet(file_path)
+            return pd.read_parquet(file_path, dtype_backend="pyarrow")
         return pd.DataFrame()
 
-    def execute_sql(self, query: str, dataset_name: str) -> pd.DataFrame:
-        """Runs SQL queries on the Parquet file directly."""
-        file_path = f"{STORAGE_PATH}/{dataset_name}.parquet"
-        # DuckDB allows querying parquet files directly
-        query = query.replace("CURRENT_TABLE", f"'{file_path}'")
-        return self.con.execute(query).df()
+    def execute_sql(self, query: str, dataset_name: str, df: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Runs SQL queries against a registered dataset view, or against df
+        (registered as dataset_name for this query only) when it is given.
+        """
+        # The view is created once per dataset, so metadata is decoded once too
+        query = query.replace("CURRENT_TABLE", _quote_identifier(dataset_name))
+        # The connection is shared by every session, so each query gets its own cursor
+        with self.con.cursor() as cur:
+            if df is not None:
+                # Zero-copy scan of the in-memory frame, visible only to this cursor
+                cur.register(dataset_name, df)
+            try:
+                # Fetch as Arrow and keep the columns Arrow-backed instead of boxing into NumPy objects
+                return cur.execute(query).fetch_arrow_table().to_pandas(types_mapper=pd.ArrowDtype)
+            finally:
+                if df is not None:
+                    cur.unregister(dataset_name)
+
+    def aggregate(self, df: pd.DataFrame, group_col: str, value_col: str, limit: int = 50) -> pd.DataFrame:
+        """Sums value_col per group_col, keeping the largest groups. Result column is 'sum(<value_col>)'."""
+        group_id = _quote_identifier(group_col)
+        value_id = _quote_identifier(value_col)
+        total_id = _quote_identifier(f"sum({value_col})")
+        # Registered on a private cursor under a unique name, so concurrent sessions never see each other's frame
+        source = f"chart_source_{uuid.uuid4().hex}"
+        with self.con.cursor() as cur:
+            cur.register(source, df)
+            try:
+                return cur.execute(
+                    f"SELECT {group_id}, SUM({value_id}) AS {total_id} FROM {source} "
+                    f"GROUP BY 1 ORDER BY 2 DESC LIMIT {int(limit)}"
+                ).fetch_arrow_table().to_pandas()
+            finally:
+                cur.unregister(source)
+
+def load_embedding_model() -> SentenceTransformer:
+    """Loads the sentence encoder, on the GPU when one is available."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return SentenceTransformer(EMBED_MODEL, device=device)
+
+def encode_texts(model: SentenceTransformer, texts: List[str]):
+    """Embeds all texts in large batches, returning unit-length float32 vectors."""
+    return model.encode(
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True
+    )
+
+def _column_as_text(series: pd.Series) -> List[str]:
+    try:
+        column = pa.array(series, from_pandas=True)
+        return pc.cast(column, pa.string()).fill_null("").to_pylist()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed object columns have no single Arrow type
+        return series.astype(str).tolist()
 
 class SearchIndexer:
     """Handles Vector Search and Indexing."""
     
-    def __init__(self):
+    def __init__(self, model: SentenceTransformer = None):
         self.client = chromadb.Client()
-        self.embed_fn = embedding_functions.DefaultEmbeddingFunction()
+        self.model = model or load_embedding_model()
+
+    def encode(self, texts: List[str]):
+        return encode_texts(self.model, texts)
 
     def index_data(self, df: pd.DataFrame, collection_name: str, key_col: str):
         """Indexes a specific text column for semantic search."""
@@ -76,23 +207,72 @@ class SearchIndexer:
         except:
             pass
         
-        collection = self.client.create_collection(name=collection_name, embedding_function=self.embed_fn)
+        # Embeddings are supplied up front, so Chroma never runs its own encoder
+        collection = self.client.create_collection(
+            name=collection_name, embedding_function=None, metadata={"hnsw:space": "ip"}
+        )
         
-        # Convert non-string data for indexing
-        documents = df[key_col].astype(str).tolist()
+        # Convert non-string data for indexing in one Arrow cast
+        documents = _column_as_text(df[key_col])
         ids = [str(i) for i in df.index.tolist()]
-        metadatas = df.to_dict(orient='records')
+        embeddings = self.encode(documents)
+        # Row metadata is never queried, so skip serializing every row into it
         
         # Batch add to avoid payload limits
-        batch_size = 100
-        for i in range(0, len(documents), batch_size):
+        for i in range(0, len(documents), INDEX_BATCH_SIZE):
             collection.add(
-                documents=documents[i:i+batch_size],
-                ids=ids[i:i+batch_size],
-                metadatas=metadatas[i:i+batch_size]
+                documents=documents[i:i+INDEX_BATCH_SIZE],
+                embeddings=embeddings[i:i+INDEX_BATCH_SIZE].tolist(),
+                ids=ids[i:i+INDEX_BATCH_SIZE]
             )
-            
+
+
     def search(self, query: str, collection_name: str, n_results=5):
         collection = self.client.get_collection(collection_name)
-        results = collection.query(query_texts=[query], n_results=n_results)
+        results = collection.query(query_embeddings=self.encode([query]).tolist(), n_results=n_results)
         return results
+
+class FAISSIndexer:
+    """In-memory vector search over int8-quantized vectors for a single dataset (no persistence)."""
+
+    def __init__(self, model: SentenceTransformer = None):
+        self.model = model or load_embedding_model()
+        # 8-bit scalar quantization: one byte per dimension instead of four
+        self.index = faiss.IndexScalarQuantizer(
+            self.model.get_sentence_embedding_dimension(),
+            faiss.ScalarQuantizer.QT_8bit,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        self.documents: List[str] = []
+
+    def index_data(self, df: pd.DataFrame, key_col: str):
+        """Indexes a specific text column for semantic search, replacing any previous data."""
+        documents = _column_as_text(df[key_col])
+        self.index.reset()
+        self.documents = documents
+        # encode([]) returns a 1-D array that normalize_L2 rejects, so stop before encoding
+        if not documents:
+            return
+        embeddings = encode_texts(self.model, documents)
+        faiss.normalize_L2(embeddings)
+        # Quantizer ranges are learned per dimension; the padding rows keep a
+        # dimension that is constant across the data from getting a zero range
+        padding = np.vstack([
+            embeddings.min(axis=0) - SQ_RANGE_MARGIN,
+            embeddings.max(axis=0) + SQ_RANGE_MARGIN
+        ])
+        self.index.train(np.vstack([embeddings, padding]).astype(np.float32))
+        self.index.add(embeddings)
+
+    def search(self, query: str, n_results=5):
+        """Returns results shaped like a Chroma query response."""
+        if self.index.ntotal == 0:
+            return {"documents": [[]], "distances": [[]]}
+        query_vec = encode_texts(self.model, [query])
+        faiss.normalize_L2(query_vec)
+        scores, positions = self.index.search(query_vec, min(n_results, self.index.ntotal))
+        hits = [(self.documents[p], float(sc)) for p, sc in zip(positions[0], scores[0]) if p != -1]
+        return {
+            "documents": [[doc for doc, _ in hits]],
+            "distances": [[score for _, score in hits]]
+        }
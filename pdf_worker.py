@@ -0,0 +1,11 @@
+import io
+from typing import List
+from pypdf import PdfReader
+
+# Kept free of heavy imports: spawned workers import only this module, not engine
+# (which would pull in torch, faiss, chromadb, ...)
+
+def extract_page_range(data: bytes, start: int, stop: int) -> List[str]:
+    """Extracts text from pages [start, stop) of a PDF."""
+    reader = PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
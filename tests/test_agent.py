@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import agent
+from agent import (
+    _clean_emails,
+    _filter_by_predicate,
+    _parse_predicate,
+    _query_expression,
+    _remove_outliers,
+    _top_performers,
+    warm_up,
+)
+
+
+def test_remove_outliers_drops_extreme_rows_and_keeps_missing():
+    values = [10.0] * 20 + [1000.0, None]
+    df = pd.DataFrame({"amount": values, "constant": [1] * len(values), "name": ["x"] * len(values)})
+    result = _remove_outliers(df)
+    assert 20 not in result.index
+    assert 21 in result.index
+    assert len(result) == 21
+
+
+def test_remove_outliers_requires_numeric_column():
+    with pytest.raises(ValueError):
+        _remove_outliers(pd.DataFrame({"name": ["a", "b"]}))
+
+
+def test_top_performers_uses_numeric_sales_column():
+    df = pd.DataFrame({"sales_rep": [f"rep{i}" for i in range(20)], "sales": np.arange(20)})
+    result = _top_performers(df)
+    assert result["sales"].tolist() == [19, 18]
+
+
+def test_top_performers_requires_numeric_sales_column():
+    with pytest.raises(ValueError):
+        _top_performers(pd.DataFrame({"sales_rep": ["a", "b"]}))
+
+
+def test_clean_emails_drops_malformed_addresses():
+    df = pd.DataFrame({"Email": ["a@example.com", "not-an-email", None, "b@test.org"]})
+    assert _clean_emails(df).index.tolist() == [0, 3]
+
+
+def test_clean_emails_requires_email_column():
+    with pytest.raises(ValueError):
+        _clean_emails(pd.DataFrame({"name": ["a"]}))
+
+
+def test_parse_predicate_numeric_and_string_clauses():
+    clauses = _parse_predicate("Filter rows where Sales > 5000 and Region is 'North'", ("Sales", "Region"))
+    assert clauses == [("Sales", ">", "5000", False), ("Region", "==", "North", True)]
+
+
+def test_parse_predicate_rejects_unsupported_rules():
+    assert _parse_predicate("Sales > 5000 or Region is 'North'", ("Sales", "Region")) is None
+    assert _parse_predicate("Convert all revenue columns to USD", ("Sales", "Region")) is None
+
+
+def test_filter_numeric_and_string_clause():
+    df = pd.DataFrame({"Sales": [100.0, 6000.0, 7000.0, 9000.0], "Region": ["North", "North", "South", None]})
+    result = _filter_by_predicate(df, "Filter rows where Sales > 5000 and Region is 'North'")
+    assert result.index.tolist() == [1]
+
+
+def test_filter_numeric_and_string_clause_arrow_backed():
+    df = pd.DataFrame({"Sales": [100, 6000, 7000], "Region": ["North", "North", "South"]})
+    df = df.convert_dtypes(dtype_backend="pyarrow")
+    result = _filter_by_predicate(df, "Sales >= 6000 and Region is not 'North'")
+    assert result.index.tolist() == [2]
+
+
+def test_filter_unknown_literal_matches_nothing():
+    df = pd.DataFrame({"Sales": [1.0, 2.0], "Region": ["North", "South"]})
+    assert _filter_by_predicate(df, "Region is 'East'").empty
+
+
+def test_warm_up():
+    warm_up()
+
+
+def test_query_expression_filters_with_boolean_mask():
+    df = pd.DataFrame({"Amount": [1, 5, 10]})
+    assert _query_expression(df, "Amount > 4").index.tolist() == [1, 2]
+
+
+def test_query_expression_arrow_backed_with_nulls():
+    df = pd.DataFrame({"Amount": [1, None, 10]}).convert_dtypes(dtype_backend="pyarrow")
+    assert _query_expression(df, "Amount > 4").index.tolist() == [2]
+
+
+def test_query_expression_rejects_non_boolean_result():
+    df = pd.DataFrame({"Amount": [3, 1, 2]})
+    assert _query_expression(df, "Amount") is None
+    assert _query_expression(df, "SELECT * FROM CURRENT_TABLE") is None
+
+
+class StubLLM:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def predict(self, prompt):
+        self.calls += 1
+        return self.answers.pop(0)
+
+
+class StubStorage:
+    def execute_sql(self, query, dataset_name, df=None):
+        if "BROKEN" in query:
+            raise RuntimeError("Parser Error")
+        return df.head(1)
+
+
+def test_failed_llm_sql_is_requested_again(monkeypatch):
+    monkeypatch.setattr(agent, "create_pandas_dataframe_agent", lambda *args, **kwargs: None)
+    llm = StubLLM(["SELECT BROKEN FROM CURRENT_TABLE", "SELECT * FROM CURRENT_TABLE LIMIT 1"])
+    transformer = agent.TransformationAgent(storage=StubStorage())
+    transformer.api_key, transformer.llm = "test-key", llm
+    df = pd.DataFrame({"revenue": [1.0, 2.0]})
+    rule = "Convert all revenue columns to USD"
+
+    assert transformer.apply_business_rule(df, rule, "standardize_currency") is df
+    assert len(transformer.apply_business_rule(df, rule, "standardize_currency")) == 1
+    assert llm.calls == 2
+
+    # A query that ran is reused without another LLM call
+    transformer.apply_business_rule(df, rule, "standardize_currency")
+    assert llm.calls == 2